@@ -1,63 +1,387 @@
 # src/agent/core_agent.py
 
+import asyncio
+import functools
+import hashlib
+import re
 import sqlite3
+import threading
+import time
+import aiosqlite
+import numpy as np
 import pandas as pd
 import plotly.express as px
-from langchain import LLMChain, PromptTemplate
-from langchain.llms import OpenAI
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import sqlglot
+from sqlglot import exp as sqlexp
+from tabulate import tabulate
+import openai
 import os
 
+# Instrucciones fijas del sistema. Todo el texto estático va en este prefijo
+# (incluyendo los ejemplos few-shot) y la pregunta del usuario se añade al
+# final como turno aparte, de modo que el proveedor pueda cachear el prefijo
+# del prompt entre peticiones (el caché exige coincidencia exacta de prefijo).
+_SYSTEM_PROMPT = (
+    "Eres un asistente que traduce preguntas en lenguaje natural sobre ventas "
+    "a consultas SQL seguras para la tabla 'ventas'. Solo genera consultas SELECT.\n"
+    "Responde únicamente con la consulta SQL, sin explicaciones.\n\n"
+    "Ejemplos:\n"
+    "Pregunta: ¿Cuáles fueron las ventas totales por ciudad?\n"
+    "SQL: SELECT ciudad, SUM(total) AS ventas_totales FROM ventas GROUP BY ciudad\n\n"
+    "Pregunta: Top 5 productos más vendidos en Medellín\n"
+    "SQL: SELECT producto, SUM(cantidad) AS unidades FROM ventas "
+    "WHERE ciudad = 'Medellín' GROUP BY producto ORDER BY unidades DESC LIMIT 5\n\n"
+    "Pregunta: ¿Cuánto se vendió en enero de 2024?\n"
+    "SQL: SELECT SUM(total) AS total FROM ventas "
+    "WHERE fecha BETWEEN '2024-01-01' AND '2024-01-31'\n\n"
+    "Pregunta: Muéstrame las últimas 10 ventas\n"
+    "SQL: SELECT * FROM ventas ORDER BY fecha DESC LIMIT 10\n\n"
+    "Pregunta: ¿Qué vendedor tuvo el mayor monto de ventas?\n"
+    "SQL: SELECT vendedor, SUM(total) AS monto FROM ventas "
+    "GROUP BY vendedor ORDER BY monto DESC LIMIT 1\n\n"
+    "Pregunta: Ventas por producto ordenadas de mayor a menor\n"
+    "SQL: SELECT producto, SUM(total) AS ventas FROM ventas "
+    "GROUP BY producto ORDER BY ventas DESC\n\n"
+    "Pregunta: ¿Cuál es el promedio de venta por ciudad?\n"
+    "SQL: SELECT ciudad, AVG(total) AS promedio FROM ventas GROUP BY ciudad\n\n"
+    "Pregunta: Total vendido por mes en 2024\n"
+    "SQL: SELECT strftime('%Y-%m', fecha) AS mes, SUM(total) AS total FROM ventas "
+    "WHERE fecha BETWEEN '2024-01-01' AND '2024-12-31' GROUP BY mes ORDER BY mes\n\n"
+    "Pregunta: ¿Cuál fue el producto menos vendido?\n"
+    "SQL: SELECT producto, SUM(cantidad) AS unidades FROM ventas "
+    "GROUP BY producto ORDER BY unidades ASC LIMIT 1\n\n"
+    "Pregunta: Ventas de Laptop en Bogotá\n"
+    "SQL: SELECT * FROM ventas WHERE producto = 'Laptop' AND ciudad = 'Bogotá'\n\n"
+    "Pregunta: ¿En cuántas ciudades distintas se ha vendido?\n"
+    "SQL: SELECT COUNT(DISTINCT ciudad) AS ciudades FROM ventas\n\n"
+    "Pregunta: ¿Cuál es la venta más alta registrada?\n"
+    "SQL: SELECT * FROM ventas ORDER BY total DESC LIMIT 1\n\n"
+    "Pregunta: Ventas por vendedor en marzo de 2024\n"
+    "SQL: SELECT vendedor, SUM(total) AS total FROM ventas "
+    "WHERE fecha BETWEEN '2024-03-01' AND '2024-03-31' GROUP BY vendedor\n\n"
+    "Pregunta: Ciudades con más de 100 ventas\n"
+    "SQL: SELECT ciudad, COUNT(*) AS n FROM ventas GROUP BY ciudad HAVING n > 100\n\n"
+    "Pregunta: Ticket promedio de cada vendedor\n"
+    "SQL: SELECT vendedor, AVG(total) AS ticket_promedio FROM ventas GROUP BY vendedor\n\n"
+    "Pregunta: Ventas del último trimestre de 2023\n"
+    "SQL: SELECT * FROM ventas WHERE fecha BETWEEN '2023-10-01' AND '2023-12-31'\n\n"
+    "Pregunta: Top 3 ciudades por ingresos\n"
+    "SQL: SELECT ciudad, SUM(total) AS ingresos FROM ventas "
+    "GROUP BY ciudad ORDER BY ingresos DESC LIMIT 3\n\n"
+    "Pregunta: Unidades vendidas de cada producto en Cali\n"
+    "SQL: SELECT producto, SUM(cantidad) AS unidades FROM ventas "
+    "WHERE ciudad = 'Cali' GROUP BY producto\n\n"
+    "Pregunta: Muéstrame las ventas superiores a 500000\n"
+    "SQL: SELECT * FROM ventas WHERE total > 500000 ORDER BY total DESC\n\n"
+    "Pregunta: ¿Cuál es la primera y la última fecha de venta?\n"
+    "SQL: SELECT MIN(fecha) AS primera, MAX(fecha) AS ultima FROM ventas\n\n"
+    "Pregunta: Ingresos totales por año\n"
+    "SQL: SELECT strftime('%Y', fecha) AS anio, SUM(total) AS ingresos FROM ventas "
+    "GROUP BY anio ORDER BY anio\n\n"
+    "Pregunta: ¿Cuántos productos distintos se han vendido?\n"
+    "SQL: SELECT COUNT(DISTINCT producto) AS productos FROM ventas\n\n"
+    "Pregunta: Cantidad promedio por venta de cada producto\n"
+    "SQL: SELECT producto, AVG(cantidad) AS cantidad_promedio FROM ventas GROUP BY producto\n\n"
+    "Pregunta: Ventas diarias de la última semana\n"
+    "SQL: SELECT fecha, SUM(total) AS total FROM ventas "
+    "WHERE fecha >= date('now', '-7 days') GROUP BY fecha ORDER BY fecha\n\n"
+    "Pregunta: Compara las ventas de 2023 y 2024 por producto\n"
+    "SQL: SELECT producto, "
+    "SUM(CASE WHEN strftime('%Y', fecha) = '2023' THEN total ELSE 0 END) AS ventas_2023, "
+    "SUM(CASE WHEN strftime('%Y', fecha) = '2024' THEN total ELSE 0 END) AS ventas_2024 "
+    "FROM ventas GROUP BY producto\n\n"
+    "Pregunta: Top 10 vendedores por unidades vendidas\n"
+    "SQL: SELECT vendedor, SUM(cantidad) AS unidades FROM ventas "
+    "GROUP BY vendedor ORDER BY unidades DESC LIMIT 10\n\n"
+    "Pregunta: ¿Qué porcentaje de los ingresos aporta cada ciudad?\n"
+    "SQL: SELECT ciudad, SUM(total) * 100.0 / (SELECT SUM(total) FROM ventas) AS porcentaje "
+    "FROM ventas GROUP BY ciudad ORDER BY porcentaje DESC\n\n"
+    "Pregunta: Ventas de Monitor por ciudad en 2024\n"
+    "SQL: SELECT ciudad, SUM(total) AS total FROM ventas "
+    "WHERE producto = 'Monitor' AND fecha BETWEEN '2024-01-01' AND '2024-12-31' "
+    "GROUP BY ciudad\n\n"
+    "Pregunta: ¿Qué día se vendió más?\n"
+    "SQL: SELECT fecha, SUM(total) AS total FROM ventas "
+    "GROUP BY fecha ORDER BY total DESC LIMIT 1\n\n"
+    "Pregunta: Vendedores con ticket promedio mayor a 200000\n"
+    "SQL: SELECT vendedor, AVG(total) AS ticket FROM ventas "
+    "GROUP BY vendedor HAVING ticket > 200000 ORDER BY ticket DESC\n\n"
+    "Pregunta: Muéstrame 20 ventas de Medellín de mayor a menor valor\n"
+    "SQL: SELECT * FROM ventas WHERE ciudad = 'Medellín' ORDER BY total DESC LIMIT 20"
+)
+
+_MODEL = "gpt-4o-mini"
+
+
+# Regexes precompiladas para el enrutado por keywords de handle_question:
+# un solo escaneo a nivel C por rama, sin asignar el string en minúsculas,
+# y sin las inconsistencias de acentos de las listas anteriores.
+_PLOT_RE = re.compile(r"gr[aá]fic[oa]s?", re.IGNORECASE)
+_FILE_RE = re.compile(r"\b(?:archivo|csv|excel|xlsx)\b", re.IGNORECASE)
+
+# Atajos deterministas para preguntas de metadatos frecuentes: mapean directo
+# a SQL fijo (ya seguro, no pasa por el sanitizador) y evitan la llamada al
+# LLM por completo — sin latencia de red y sin riesgo de joins alucinados.
+_FAST_PATHS = [
+    (re.compile(r"cu[aá]nt[ao]s (?:filas|registros|ventas hay)"), "SELECT COUNT(*) AS n FROM ventas"),
+    (re.compile(r"qu[eé] columnas"), "PRAGMA table_info(ventas)"),
+    (re.compile(r"(?:esquema|estructura) de la tabla"), "PRAGMA table_info(ventas)"),
+]
+
+# Tipos de nodos AST que nunca deben aparecer en una consulta generada.
+_FORBIDDEN_NODES = (
+    sqlexp.Delete,
+    sqlexp.Update,
+    sqlexp.Insert,
+    sqlexp.Drop,
+    sqlexp.Alter,
+    sqlexp.Command,
+)
+
+
+# Caché en disco de (pregunta normalizada -> SQL sanitizado): a diferencia del
+# LRU en memoria, sobrevive reinicios y se comparte entre workers en la misma
+# máquina, así un proceso nuevo no vuelve a pagar el LLM por preguntas repetidas.
+_DISK_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "agent_ventas", "nl2sql.db"
+)
+_DISK_CACHE_TTL = 86400  # segundos; el SQL cacheado caduca al día
+
+
+@functools.lru_cache(maxsize=1)
+def _get_disk_cache() -> sqlite3.Connection:
+    """Abre (y crea si hace falta) la base SQLite del caché NL -> SQL."""
+    os.makedirs(os.path.dirname(_DISK_CACHE_PATH), exist_ok=True)
+    conn = sqlite3.connect(_DISK_CACHE_PATH, check_same_thread=False, isolation_level=None)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS nl2sql (key TEXT PRIMARY KEY, sql TEXT, ts INTEGER)"
+    )
+    return conn
+
+
+def _disk_cache_get(normalized_question: str):
+    """Devuelve el SQL cacheado para la pregunta normalizada, o None si no hay hit vigente."""
+    key = hashlib.sha256(normalized_question.encode("utf-8")).hexdigest()
+    row = _get_disk_cache().execute(
+        "SELECT sql, ts FROM nl2sql WHERE key = ?", (key,)
+    ).fetchone()
+    if row is None or time.time() - row[1] > _DISK_CACHE_TTL:
+        return None
+    return row[0]
+
+
+def _disk_cache_set(normalized_question: str, sql: str) -> None:
+    """Guarda el SQL sanitizado en el caché en disco."""
+    key = hashlib.sha256(normalized_question.encode("utf-8")).hexdigest()
+    _get_disk_cache().execute(
+        "INSERT OR REPLACE INTO nl2sql (key, sql, ts) VALUES (?, ?, ?)",
+        (key, sql, int(time.time())),
+    )
+
+
+@functools.lru_cache(maxsize=1)
+def _get_client() -> openai.OpenAI:
+    """
+    Devuelve el cliente OpenAI compartido por todas las instancias de CoreAgent.
+    Construir un cliente por instancia re-lee la API key y crea una sesión
+    httpx nueva (con su propio pool TCP/TLS); compartirlo amortiza todo eso y
+    reutiliza keep-alive y estado de reintentos entre peticiones.
+    """
+    return openai.OpenAI()
+
+
+@functools.lru_cache(maxsize=1)
+def _get_async_client() -> openai.AsyncOpenAI:
+    """Cliente OpenAI asíncrono compartido, para la ruta ahandle_question."""
+    return openai.AsyncOpenAI()
+
+
+def _normalize_question(question: str) -> str:
+    """Normaliza la pregunta (minúsculas, espacios colapsados) para usarla como clave de caché."""
+    return re.sub(r"\s+", " ", question.strip().lower())
+
+
+def _complete(question: str) -> str:
+    """
+    Llama al SDK de openai directamente con el prompt ya renderizado,
+    usando el cliente compartido. LLMChain añadía gestor de callbacks,
+    re-render del template y validación de claves de entrada en cada
+    llamada; para un prompt de una sola variable eso es puro overhead
+    en el camino caliente.
+    """
+    resp = _get_client().chat.completions.create(
+        model=_MODEL,
+        temperature=0,
+        messages=[
+            {"role": "system", "content": _SYSTEM_PROMPT},
+            {"role": "user", "content": question},
+        ],
+        extra_body={"prompt_cache_key": "nl2sql_v1"},
+    )
+    return resp.choices[0].message.content
+
+
+def _sanitize_sql(sql: str) -> str:
+    """
+    Valida que la consulta SQL sea segura parseando el AST con sqlglot:
+    - Solo permite una consulta SELECT (varias sentencias no parsean).
+    - No permite nodos peligrosos (DROP, DELETE, UPDATE, INSERT, ALTER...).
+    - Agrega LIMIT 100 si no está presente para limitar resultados.
+    Un único parse reemplaza los escaneos por substring, que daban falsos
+    positivos en literales ("...don't delete") y dejaban pasar sentencias
+    encadenadas con ';'.
+    """
+    try:
+        tree = sqlglot.parse_one(sql, read="sqlite")
+    except sqlglot.errors.ParseError as e:
+        raise ValueError(f"Consulta SQL inválida: {e}")
+    if not isinstance(tree, sqlexp.Select):
+        raise ValueError("Solo se permiten consultas SELECT.")
+    if tree.find(*_FORBIDDEN_NODES):
+        raise ValueError("Consulta SQL contiene comandos no permitidos.")
+    if tree.args.get("limit") is None:
+        tree = tree.limit(100)
+    return tree.sql(dialect="sqlite")
+
+
+# Caché en memoria de (pregunta normalizada -> SQL sanitizado). Dict plano a
+# nivel de módulo en lugar de lru_cache sobre el agente: la clave es solo el
+# texto normalizado, así los hits se comparten entre instancias de CoreAgent
+# (p. ej. servidores que crean un agente por petición) y el caché no retiene
+# instancias vivas — cada una mantiene abierta su conexión SQLite.
+_NL2SQL_CACHE: dict = {}
+_NL2SQL_CACHE_MAX = 1024
+
+
+def _nl_to_sql_cached(question: str, normalized_question: str) -> str:
+    """
+    Traduce la pregunta a SQL con caché en memoria y en disco, ambos keyed
+    por la forma normalizada. Al LLM siempre se le envía la pregunta
+    ORIGINAL: mandar el texto en minúsculas alteraba los literales generados
+    ('Medellín' -> 'medellín') y el '=' de SQLite distingue mayúsculas, con
+    lo que consultas válidas volvían vacías.
+    """
+    hit = _NL2SQL_CACHE.get(normalized_question)
+    if hit is not None:
+        return hit
+    sql_query = _disk_cache_get(normalized_question)
+    if sql_query is None:
+        sql_query = _sanitize_sql(_complete(question))
+        _disk_cache_set(normalized_question, sql_query)
+    if len(_NL2SQL_CACHE) >= _NL2SQL_CACHE_MAX:
+        _NL2SQL_CACHE.pop(next(iter(_NL2SQL_CACHE)))  # descarta la entrada más vieja
+    _NL2SQL_CACHE[normalized_question] = sql_query
+    return sql_query
+
 class SQLConnector:
     """Conector simple a SQLite para ejecutar consultas SQL y devolver DataFrame."""
     def __init__(self, db_path="ventas.db"):
         self.db_path = db_path
+        # Conexión única y de larga vida: abrir una conexión nueva por consulta
+        # paga apertura de archivo + caché de páginas fría en cada llamada.
+        # cached_statements amplía el caché de sentencias preparadas de sqlite
+        # (keyed por texto SQL), así los SELECT repetidos y los fast paths
+        # reutilizan el programa VDBE ya compilado en vez de re-parsear.
+        self._conn = sqlite3.connect(
+            db_path,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=256,
+        )
+        self._cursor = self._conn.cursor()  # cursor reutilizado entre consultas
+        self._lock = threading.Lock()  # sqlite serializa escrituras; un lock basta
+        self._conn.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA cache_size=-65536;
+            PRAGMA busy_timeout=5000;
+            PRAGMA mmap_size=268435456;
+            """
+        )
 
     def execute_query(self, query: str) -> pd.DataFrame:
-        # Abrir conexión SQLite y ejecutar consulta dentro de contexto para cierre automático
-        with sqlite3.connect(self.db_path) as conn:
-            df = pd.read_sql_query(query, conn)
-        return df
+        # Reutilizar la conexión compartida (caché de páginas caliente entre consultas).
+        # Cursor directo en vez de pd.read_sql_query: evita el adaptador intermedio
+        # de pandas y sus copias extra; con el LIMIT 100 el fetchall es barato.
+        with self._lock:
+            self._cursor.execute(query)
+            columns = [d[0] for d in self._cursor.description]
+            rows = self._cursor.fetchall()
+        return pd.DataFrame.from_records(rows, columns=columns)
+
+    def execute_head(self, query: str, n: int = 10):
+        """
+        Ejecuta la consulta y devuelve solo las primeras n filas como
+        (columnas, filas) en Python plano, sin construir un DataFrame.
+        Para la ruta de 'mostrar tabla' evita las asignaciones de bloques
+        numpy y el pase de formateo de df.to_string solo para imprimir 10 filas.
+        """
+        with self._lock:
+            self._cursor.execute(query)
+            columns = [d[0] for d in self._cursor.description]
+            rows = self._cursor.fetchmany(n)
+        return columns, rows
+
+    async def aexecute_query(self, query: str) -> pd.DataFrame:
+        """Versión asíncrona de execute_query usando aiosqlite (no bloquea el event loop)."""
+        async with aiosqlite.connect(self.db_path) as conn:
+            async with conn.execute(query) as cursor:
+                columns = [d[0] for d in cursor.description]
+                rows = await cursor.fetchall()
+        return pd.DataFrame.from_records(rows, columns=columns)
+
+    async def aexecute_head(self, query: str, n: int = 10):
+        """Versión asíncrona de execute_head."""
+        async with aiosqlite.connect(self.db_path) as conn:
+            async with conn.execute(query) as cursor:
+                columns = [d[0] for d in cursor.description]
+                rows = await cursor.fetchmany(n)
+        return columns, rows
 
 class CoreAgent:
     def __init__(self, db_path="ventas.db"):
-        # Configuración del modelo LLM y prompt para traducción NL -> SQL
-        self.llm = OpenAI(temperature=0)
-        self.prompt = PromptTemplate(
-            input_variables=["question"],
-            template=(
-                "Eres un asistente que traduce preguntas en lenguaje natural sobre ventas "
-                "a consultas SQL seguras para la tabla 'ventas'. Solo genera consultas SELECT.\n"
-                "Pregunta: {question}\nSQL:"
-            )
-        )
-        self.chain = LLMChain(llm=self.llm, prompt=self.prompt)
+        # El cliente OpenAI es un singleton a nivel de módulo (_get_client),
+        # así que el constructor solo prepara el conector y el directorio de salida.
         self.sql_connector = SQLConnector(db_path)
+        # Crear el directorio de salida una sola vez: os.makedirs hace un stat
+        # por componente de la ruta, syscalls inútiles en el camino caliente.
+        os.makedirs("output", exist_ok=True)
+        self._dir_cache = {"output"}
+
+    def _ensure_dir(self, path: str) -> None:
+        """Crea el directorio padre de path si no se ha creado ya en esta sesión."""
+        dirname = os.path.dirname(path)
+        if dirname and dirname not in self._dir_cache:
+            os.makedirs(dirname, exist_ok=True)
+            self._dir_cache.add(dirname)
 
     def nl_to_sql(self, question: str) -> str:
         """
         Traduce la pregunta en lenguaje natural a una consulta SQL usando el LLM.
         Luego sanitiza la consulta para seguridad.
+        Las respuestas se cachean en memoria (LRU) por pregunta normalizada,
+        así las preguntas repetidas no vuelven a llamar al LLM.
+        Las preguntas de metadatos conocidas se resuelven con SQL fijo sin LLM.
         """
-        sql_query = self.chain.run(question=question)
-        sql_query = self._sanitize_sql(sql_query)
-        return sql_query
+        normalized = _normalize_question(question)
+        for pattern, fixed_sql in _FAST_PATHS:
+            if pattern.search(normalized):
+                return fixed_sql
+        return _nl_to_sql_cached(question, normalized)
+
+    def invalidate(self):
+        """Limpia las cachés de traducciones NL -> SQL, en memoria y en disco
+        (por ejemplo si cambia el esquema)."""
+        _NL2SQL_CACHE.clear()
+        _get_disk_cache().execute("DELETE FROM nl2sql")
 
     def _sanitize_sql(self, sql: str) -> str:
-        """
-        Valida que la consulta SQL sea segura:
-        - Solo permite consultas SELECT.
-        - No permite comandos peligrosos (DROP, DELETE, UPDATE, INSERT, ALTER).
-        - Agrega LIMIT 100 si no está presente para limitar resultados.
-        """
-        sql_lower = sql.strip().lower()
-        if not sql_lower.startswith("select"):
-            raise ValueError("Solo se permiten consultas SELECT.")
-        forbidden = ["drop", "delete", "update", "insert", "alter"]
-        if any(word in sql_lower for word in forbidden):
-            raise ValueError("Consulta SQL contiene comandos no permitidos.")
-        if "limit" not in sql_lower:
-            sql += " LIMIT 100"
-        return sql
+        """Valida la consulta SQL generada (ver _sanitize_sql a nivel de módulo)."""
+        return _sanitize_sql(sql)
 
     def execute_sql(self, sql: str) -> pd.DataFrame:
         """Ejecuta la consulta SQL usando el conector y devuelve un DataFrame."""
@@ -73,23 +397,56 @@ class CoreAgent:
         if df.empty:
             return "No hay datos para graficar."
 
-        numeric_cols = df.select_dtypes(include='number').columns
-        if len(numeric_cols) == 0:
+        # Máscara NumPy sobre los códigos de dtype (i/u/f/c = entero/unsigned/
+        # float/complejo): una sola reducción vectorizada en vez de un bucle
+        # Python por columna, relevante para resultados anchos (pivots).
+        dtype_kinds = np.frombuffer(
+            "".join(dt.kind for dt in df.dtypes.values).encode("ascii"), dtype="S1"
+        )
+        numeric_mask = np.isin(dtype_kinds, [b"i", b"u", b"f", b"c"])
+        if not numeric_mask.any():
             return "No hay columnas numéricas para graficar."
 
         x_col = df.columns[0]
-        y_col = numeric_cols[0]
+        y_col = df.columns[int(numeric_mask.argmax())]
+
+        # Clave estable por (datos, pregunta): si ya existe el HTML para esta
+        # combinación, se devuelve sin reconstruir la figura ni reescribir el
+        # archivo. A diferencia de hash(), la clave sobrevive reinicios del
+        # proceso (hash() está aleatorizado por PYTHONHASHSEED).
+        key = hashlib.blake2b(
+            pd.util.hash_pandas_object(df, index=True).values.tobytes() + question.encode("utf-8"),
+            digest_size=16,
+        ).hexdigest()
+        graph_path = f"output/graph_{key}.html"
+        if os.path.exists(graph_path):
+            return f"Gráfico generado y guardado en {graph_path}"
 
         fig = px.bar(df, x=x_col, y=y_col, title=question)
-        graph_path = f"output/graph_{abs(hash(question))}.html"  # Nombre único para evitar sobrescribir
-        os.makedirs(os.path.dirname(graph_path), exist_ok=True)
-        fig.write_html(graph_path)
+        self._ensure_dir(graph_path)
+        # include_plotlyjs="cdn" referencia la librería desde CDN en lugar de
+        # incrustar el bundle de ~3MB de Plotly.js en cada archivo HTML.
+        fig.write_html(graph_path, include_plotlyjs="cdn")
         return f"Gráfico generado y guardado en {graph_path}"
 
-    def save_file(self, df: pd.DataFrame, filename="output/data.csv") -> str:
-        """Guarda el DataFrame en un archivo CSV (puedes extender a Excel si quieres)."""
-        os.makedirs(os.path.dirname(filename), exist_ok=True)
-        df.to_csv(filename, index=False)
+    def save_file(self, df: pd.DataFrame, filename="output/data.csv", format=None) -> str:
+        """
+        Guarda el DataFrame en disco. El formato se infiere de la extensión
+        (o se fuerza con format="parquet"/"excel"/"csv"):
+        - .parquet: columnar binario vía pyarrow + zstd; mucho más rápido y
+          compacto que CSV y preserva los dtypes para consumidores analíticos.
+        - .xlsx: Excel vía openpyxl.
+        - por defecto CSV con pyarrow.csv.write_csv, que serializa los buffers
+          columnares en C en lugar del formateo celda a celda de df.to_csv.
+        """
+        self._ensure_dir(filename)
+        if format == "parquet" or filename.endswith(".parquet"):
+            df.to_parquet(filename, engine="pyarrow", compression="zstd", index=False)
+        elif format == "excel" or filename.endswith(".xlsx"):
+            df.to_excel(filename, index=False, engine="openpyxl")
+        else:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            pacsv.write_csv(table, filename, write_options=pacsv.WriteOptions(include_header=True))
         return f"Archivo guardado en {filename}"
 
     def handle_question(self, question: str):
@@ -101,19 +458,75 @@ class CoreAgent:
         """
         try:
             sql = self.nl_to_sql(question)
-            df = self.execute_sql(sql)
 
-            question_lower = question.lower()
-            if any(keyword in question_lower for keyword in ["gráfico", "grafico", "gráficos", "grafica"]):
-                return self.generate_plot(df, question)
-            elif any(keyword in question_lower for keyword in ["archivo", "csv", "excel"]):
+            if _PLOT_RE.search(question):
+                return self.generate_plot(self.execute_sql(sql), question)
+            elif _FILE_RE.search(question):
                 # Aquí podrías mejorar para detectar nombre de archivo dinámico
                 filename = "output/ventas.csv"
-                return self.save_file(df, filename)
+                return self.save_file(self.execute_sql(sql), filename)
+            else:
+                # Mostrar tabla simple (primeras 10 filas): solo esta ruta no
+                # necesita DataFrame, así que se piden las filas en Python plano
+                # y se formatea con tabulate, sin pasar por numpy/pandas.
+                columns, rows = self.sql_connector.execute_head(sql, n=10)
+                if not rows:
+                    return "No se encontraron resultados."
+                return tabulate(rows, headers=columns)
+        except Exception as e:
+            return f"Error: {e}"
+
+    async def anl_to_sql(self, question: str) -> str:
+        """Versión asíncrona de nl_to_sql: usa el cliente openai asíncrono para
+        no bloquear el event loop. Comparte las cachés en memoria y en disco con
+        la ruta síncrona; al LLM se le envía la pregunta original (ver
+        _nl_to_sql_cached)."""
+        normalized = _normalize_question(question)
+        for pattern, fixed_sql in _FAST_PATHS:
+            if pattern.search(normalized):
+                return fixed_sql
+        hit = _NL2SQL_CACHE.get(normalized)
+        if hit is not None:
+            return hit
+        sql_query = _disk_cache_get(normalized)
+        if sql_query is None:
+            resp = await _get_async_client().chat.completions.create(
+                model=_MODEL,
+                temperature=0,
+                messages=[
+                    {"role": "system", "content": _SYSTEM_PROMPT},
+                    {"role": "user", "content": question},
+                ],
+                extra_body={"prompt_cache_key": "nl2sql_v1"},
+            )
+            sql_query = _sanitize_sql(resp.choices[0].message.content)
+            _disk_cache_set(normalized, sql_query)
+        if len(_NL2SQL_CACHE) >= _NL2SQL_CACHE_MAX:
+            _NL2SQL_CACHE.pop(next(iter(_NL2SQL_CACHE)))
+        _NL2SQL_CACHE[normalized] = sql_query
+        return sql_query
+
+    async def ahandle_question(self, question: str):
+        """
+        Versión asíncrona de handle_question, pensada para servidores con varios
+        usuarios concurrentes: la llamada al LLM y la consulta SQLite son await-ables,
+        y la escritura de gráficos/archivos se despacha a un hilo con asyncio.to_thread
+        para que varias preguntas en vuelo puedan intercalarse.
+        """
+        try:
+            sql = await self.anl_to_sql(question)
+
+            if _PLOT_RE.search(question):
+                df = await self.sql_connector.aexecute_query(sql)
+                return await asyncio.to_thread(self.generate_plot, df, question)
+            elif _FILE_RE.search(question):
+                df = await self.sql_connector.aexecute_query(sql)
+                filename = "output/ventas.csv"
+                return await asyncio.to_thread(self.save_file, df, filename)
             else:
-                # Mostrar tabla simple (primeras 10 filas)
-                if df.empty:
+                columns, rows = await self.sql_connector.aexecute_head(sql, n=10)
+                if not rows:
                     return "No se encontraron resultados."
-                return df.head(10).to_string(index=False)
+                return tabulate(rows, headers=columns)
         except Exception as e:
             return f"Error: {e}"